@@ -1,4 +1,10 @@
 import os
+import time
+import glob
+import uuid
+import shutil
+import hashlib
+import tempfile
 from datetime import datetime
 import streamlit as st
 from PIL import Image
@@ -14,9 +20,16 @@ st.set_page_config(
 )
 
 try:
-    from image_processor import process_image, get_image_download_link, load_model
+    from utils import process_images, get_image_download_link, api_reachable
 except ImportError:
-    from .image_processor import process_image, get_image_download_link, load_model
+    from .utils import process_images, get_image_download_link, api_reachable
+
+@st.cache_resource
+def _load_logo():
+    """Carga el logo una sola vez por proceso."""
+    logo = Image.open('attached_assets/iflexo6-final.png')
+    logo.load()
+    return logo
 
 def check_token():
     """Verifica el token de acceso."""
@@ -40,10 +53,64 @@ def check_token():
 
     return session_token == correct_token
 
+MAX_HISTORY_ENTRIES = 20
+MAX_UPLOAD_MB = 200
+THUMBNAIL_SIZE = (256, 256)
+HISTORY_MAX_AGE = 24 * 3600  # Segundos sin escrituras antes de borrar el directorio de una sesión
+
 def initialize_session_state():
     """Inicializa las variables de estado de la sesión"""
     if 'processed_images_history' not in st.session_state:
         st.session_state.processed_images_history = []
+    if 'session_id' not in st.session_state:
+        st.session_state.session_id = uuid.uuid4().hex
+        cleanup_stale_history_dirs()
+
+def history_dir():
+    """Directorio temporal donde se guardan las imágenes del historial de la sesión."""
+    return os.path.join(tempfile.gettempdir(), f"iup_{st.session_state.session_id}")
+
+def cleanup_stale_history_dirs():
+    """Borra los directorios de historial de sesiones sin actividad reciente."""
+    cutoff = time.time() - HISTORY_MAX_AGE
+    for path in glob.glob(os.path.join(tempfile.gettempdir(), "iup_*")):
+        try:
+            if path != history_dir() and os.path.getmtime(path) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            # Otra sesión pudo haberlo borrado entre el glob y la comprobación
+            continue
+
+def make_thumbnail(image):
+    """Genera una miniatura para mostrar en el historial."""
+    thumb = image.copy()
+    thumb.thumbnail(THUMBNAIL_SIZE)
+    return thumb
+
+def save_history_file(data, extension):
+    """Guarda los bytes de la imagen en el directorio temporal de la sesión y devuelve la ruta."""
+    session_dir = history_dir()
+    os.makedirs(session_dir, exist_ok=True)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    path = os.path.join(session_dir, f"{digest}.{extension}")
+    if not os.path.exists(path):
+        with open(path, "wb") as file:
+            file.write(data)
+    else:
+        # Mantener el directorio como activo para la limpieza por antigüedad
+        os.utime(session_dir)
+    return path
+
+def add_history_entry(entry):
+    """Agrega una entrada al historial descartando las más antiguas (FIFO)."""
+    history = st.session_state.processed_images_history
+    history.append(entry)
+    while len(history) > MAX_HISTORY_ENTRIES:
+        evicted = history.pop(0)
+        in_use = {path for item in history for path in (item['original_path'], item['processed_path'])}
+        for path in (evicted['original_path'], evicted['processed_path']):
+            if path not in in_use and os.path.exists(path):
+                os.remove(path)
 
 def main():
     initialize_session_state()
@@ -55,8 +122,7 @@ def main():
 
     # Mostrar logo
     try:
-        logo = Image.open('attached_assets/iflexo6-final.png')
-        st.image(logo, width=200)
+        st.image(_load_logo(), width=200)
     except Exception as e:
         st.warning("No se pudo cargar el logo")
 
@@ -84,8 +150,7 @@ def main():
             else:
                 # Intentar cargar el modelo para verificar la conexión
                 with st.spinner("Verificando conexión con la API..."):
-                    client = load_model()
-                    if client is not None:
+                    if api_reachable():
                         api_status.success("✅ API conectada y funcionando")
                     else:
                         api_status.error("❌ Error en la conexión con la API")
@@ -95,188 +160,220 @@ def main():
             st.session_state.access_token = ""
             st.experimental_rerun()
 
-        # Subida de archivo
-        uploaded_file = st.file_uploader(
-            "Selecciona una imagen (JPG o PNG)",
+        # Subida de archivos
+        uploaded_files = st.file_uploader(
+            "Selecciona una o más imágenes (JPG o PNG)",
             type=["jpg", "jpeg", "png"],
-            help="Formatos soportados: JPG, JPEG, PNG. Las imágenes muy grandes se redimensionarán automáticamente."
+            accept_multiple_files=True,
+            help="Formatos soportados: JPG, JPEG, PNG. Varias imágenes se procesan en paralelo. Las imágenes muy grandes se redimensionarán automáticamente."
         )
 
-        # Configuración básica
-        col1, col2 = st.columns(2)
-        with col1:
-            scale_factor = st.select_slider(
-                "Factor de escala",
-                options=[2, 3],
-                value=2,
-                help="Factor por el cual se aumentará la resolución de la imagen"
-            )
-
-        with col2:
-            upscale_method = st.selectbox(
-                "Método de upscaling",
-                options=["✨ Clarity AI (Mejor Calidad)"],
-                help="Clarity AI ofrece los mejores resultados para la mayoría de las imágenes"
-            )
-
-        # Opciones avanzadas
-        with st.expander("⚙️ Opciones Avanzadas"):
-            st.info("Estas opciones permiten un control más preciso sobre el proceso de mejora")
-
-            advanced_col1, advanced_col2 = st.columns(2)
-
-            with advanced_col1:
-                face_enhance = st.toggle(
-                    "Mejorar rostros",
-                    value=True,
-                    help="Aplica mejoras específicas para rostros en la imagen"
-                )
+        # Vista previa de las imágenes originales, fuera del formulario
+        uploads = []
+        for uploaded_file in uploaded_files or []:
+            try:
+                # Verificar tamaño de archivo antes de enviarlo
+                file_size = uploaded_file.size / (1024 * 1024)  # Convertir a MB
+                if file_size > MAX_UPLOAD_MB:
+                    st.warning(f"⚠️ {uploaded_file.name} supera los {MAX_UPLOAD_MB}MB y no se procesará.")
+                    continue
+
+                # Leer imagen original; los bytes se muestran tal cual, sin re-serializar
+                uploaded_bytes = uploaded_file.getvalue()
+                image = Image.open(io.BytesIO(uploaded_bytes))
 
-                denoise_level = st.slider(
-                    "Nivel de reducción de ruido",
-                    min_value=0,
-                    max_value=3,
-                    value=1,
-                    help="Mayor valor = más suavizado, menor valor = más detalle"
+                # Crear columnas para comparación side-by-side
+                col1, col2 = st.columns(2)
+
+                with col1:
+                    st.subheader("Imagen Original")
+                    st.image(uploaded_bytes, caption=uploaded_file.name, use_container_width=True)
+                    st.info(f"Dimensiones originales: {image.size[0]}x{image.size[1]} px")
+
+                uploads.append({
+                    "file": uploaded_file,
+                    "bytes": uploaded_bytes,
+                    "image": image,
+                    "result_column": col2
+                })
+
+            except Exception as e:
+                st.error(f"Error al procesar la imagen {uploaded_file.name}: {str(e)}")
+                st.info("Por favor, asegúrate de usar una imagen en formato JPG o PNG válido.")
+
+        # Los controles van en un formulario para que solo el envío dispare un rerun
+        with st.form("process_form"):
+            # Configuración básica
+            config_col1, config_col2 = st.columns(2)
+            with config_col1:
+                scale_factor = st.select_slider(
+                    "Factor de escala",
+                    options=[2, 3],
+                    value=2,
+                    help="Factor por el cual se aumentará la resolución de la imagen"
                 )
 
-            with advanced_col2:
-                output_format = st.selectbox(
-                    "Formato de salida",
-                    options=["PNG", "JPEG"],
-                    index=0,
-                    help="PNG mantiene mejor calidad pero genera archivos más grandes"
+            with config_col2:
+                upscale_method = st.selectbox(
+                    "Método de upscaling",
+                    options=["✨ Clarity AI (Mejor Calidad)"],
+                    help="Clarity AI ofrece los mejores resultados para la mayoría de las imágenes"
                 )
 
-                if output_format == "JPEG":
+            # Opciones avanzadas
+            with st.expander("⚙️ Opciones Avanzadas"):
+                st.info("Estas opciones permiten un control más preciso sobre el proceso de mejora")
+
+                advanced_col1, advanced_col2 = st.columns(2)
+
+                with advanced_col1:
+                    face_enhance = st.toggle(
+                        "Mejorar rostros",
+                        value=True,
+                        help="Aplica mejoras específicas para rostros en la imagen"
+                    )
+
+                    denoise_level = st.slider(
+                        "Nivel de reducción de ruido",
+                        min_value=0,
+                        max_value=3,
+                        value=1,
+                        help="Mayor valor = más suavizado, menor valor = más detalle"
+                    )
+
+                with advanced_col2:
+                    output_format = st.selectbox(
+                        "Formato de salida",
+                        options=["PNG", "JPEG"],
+                        index=0,
+                        help="PNG mantiene mejor calidad pero genera archivos más grandes"
+                    )
+
+                    # Dentro del formulario no hay rerun al cambiar el formato, así que siempre se muestra
                     jpeg_quality = st.slider(
                         "Calidad JPEG",
                         min_value=60,
                         max_value=100,
                         value=95,
-                        help="Mayor valor = mejor calidad pero archivo más grande"
+                        help="Solo se aplica con formato JPEG. Mayor valor = mejor calidad pero archivo más grande"
                     )
 
-        # Modo de ajuste fino
-        with st.expander("🎨 Modo de Ajuste Fino"):
-            st.info("Ajusta con precisión los parámetros de calidad de la imagen")
+            # Modo de ajuste fino
+            with st.expander("🎨 Modo de Ajuste Fino"):
+                st.info("Ajusta con precisión los parámetros de calidad de la imagen")
 
-            fine_tune_col1, fine_tune_col2 = st.columns(2)
+                fine_tune_col1, fine_tune_col2 = st.columns(2)
 
-            with fine_tune_col1:
-                sharpness = st.slider(
-                    "Nitidez",
-                    min_value=0.0,
-                    max_value=2.0,
-                    value=1.0,
-                    step=0.1,
-                    help="Ajusta la nitidez de los detalles en la imagen"
-                )
+                with fine_tune_col1:
+                    sharpness = st.slider(
+                        "Nitidez",
+                        min_value=0.0,
+                        max_value=2.0,
+                        value=1.0,
+                        step=0.1,
+                        help="Ajusta la nitidez de los detalles en la imagen"
+                    )
 
-                contrast = st.slider(
-                    "Contraste",
-                    min_value=0.0,
-                    max_value=2.0,
-                    value=1.0,
-                    step=0.1,
-                    help="Ajusta la diferencia entre claros y oscuros"
-                )
+                    contrast = st.slider(
+                        "Contraste",
+                        min_value=0.0,
+                        max_value=2.0,
+                        value=1.0,
+                        step=0.1,
+                        help="Ajusta la diferencia entre claros y oscuros"
+                    )
 
-            with fine_tune_col2:
-                brightness = st.slider(
-                    "Brillo",
-                    min_value=0.0,
-                    max_value=2.0,
-                    value=1.0,
-                    step=0.1,
-                    help="Ajusta la luminosidad general de la imagen"
-                )
+                with fine_tune_col2:
+                    brightness = st.slider(
+                        "Brillo",
+                        min_value=0.0,
+                        max_value=2.0,
+                        value=1.0,
+                        step=0.1,
+                        help="Ajusta la luminosidad general de la imagen"
+                    )
 
-                color_balance = st.slider(
-                    "Balance de Color",
-                    min_value=0.0,
-                    max_value=2.0,
-                    value=1.0,
-                    step=0.1,
-                    help="Ajusta la intensidad de los colores"
-                )
+                    color_balance = st.slider(
+                        "Balance de Color",
+                        min_value=0.0,
+                        max_value=2.0,
+                        value=1.0,
+                        step=0.1,
+                        help="Ajusta la intensidad de los colores"
+                    )
+
+            submitted = st.form_submit_button("Procesar Imagen", type="primary")
 
         # Procesamiento de imagen
-        if uploaded_file:
+        if submitted and uploads:
             try:
-                # Leer imagen original
-                image = Image.open(uploaded_file)
-
-                # Verificar tamaño de archivo
-                file_size = uploaded_file.size / (1024 * 1024)  # Convertir a MB
-                if file_size > 200:
-                    st.warning("""
-                    ⚠️ La imagen es grande (>200MB). El procesamiento puede tomar más tiempo.
-                    Sugerencias para optimizar el proceso:
-                    1. Usar el formato JPEG para la salida
-                    2. Ajustar la calidad JPEG si es necesario
-                    """)
-
-                # Crear columnas para comparación side-by-side
-                col1, col2 = st.columns(2)
-
-                with col1:
-                    st.subheader("Imagen Original")
-                    st.image(image, use_container_width=True)
-                    st.info(f"Dimensiones originales: {image.size[0]}x{image.size[1]} px")
-
-                if st.button("Procesar Imagen", type="primary"):
-                    with st.spinner("Procesando imagen con IA... Esto puede tomar unos momentos."):
-                        # Crear diccionario de parámetros avanzados
-                        advanced_params = {
+                with st.spinner("Procesando imágenes con IA... Esto puede tomar unos momentos."):
+                    # Crear diccionario de parámetros avanzados
+                    advanced_params = {
+                        "face_enhance": face_enhance,
+                        "denoise_level": denoise_level,
+                        "output_format": output_format.lower(),
+                        "jpeg_quality": jpeg_quality if output_format == "JPEG" else None,
+                        "sharpness": sharpness,
+                        "contrast": contrast,
+                        "brightness": brightness,
+                        "color_balance": color_balance
+                    }
+
+                    results = process_images([upload["image"] for upload in uploads],
+                                             scale_factor, advanced_params)
+
+                timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                for upload, result in zip(uploads, results):
+                    if not result:
+                        continue
+
+                    uploaded_file = upload["file"]
+                    processed_image, processed_data, processed_mime = result
+                    with upload["result_column"]:
+                        st.subheader("Imagen Mejorada")
+                        st.image(processed_data, use_container_width=True)
+                        st.info(f"Nuevas dimensiones: {processed_image.size[0]}x{processed_image.size[1]} px")
+
+                        # Botón de descarga
+                        base_name = os.path.splitext(uploaded_file.name)[0]
+                        extension = "jpg" if processed_mime == "image/jpeg" else "png"
+                        download_filename = f"mejorada_{base_name}.{extension}"
+                        st.markdown(
+                            get_image_download_link(processed_data, download_filename,
+                                                    "📥 Descargar imagen mejorada", processed_mime),
+                            unsafe_allow_html=True
+                        )
+
+                    # Guardar en el historial
+                    original_extension = os.path.splitext(uploaded_file.name)[1].lstrip('.').lower() or "png"
+                    history_entry = {
+                        "timestamp": timestamp,
+                        "original_thumb": make_thumbnail(upload["image"]),
+                        "processed_thumb": make_thumbnail(processed_image),
+                        "original_path": save_history_file(upload["bytes"], original_extension),
+                        "processed_path": save_history_file(processed_data, extension),
+                        "processed_mime": processed_mime,
+                        "download_filename": download_filename,
+                        "original_name": uploaded_file.name,
+                        "parameters": {
+                            "scale_factor": scale_factor,
                             "face_enhance": face_enhance,
                             "denoise_level": denoise_level,
-                            "output_format": output_format.lower(),
-                            "jpeg_quality": jpeg_quality if output_format == "JPEG" else None,
+                            "output_format": output_format,
                             "sharpness": sharpness,
                             "contrast": contrast,
                             "brightness": brightness,
                             "color_balance": color_balance
                         }
-
-                        processed_image = process_image(image, scale_factor, advanced_params)
-
-                    if processed_image:
-                        with col2:
-                            st.subheader("Imagen Mejorada")
-                            st.image(processed_image, use_container_width=True)
-                            st.info(f"Nuevas dimensiones: {processed_image.size[0]}x{processed_image.size[1]} px")
-
-                            # Botón de descarga
-                            download_filename = f"mejorada_{uploaded_file.name}"
-                            st.markdown(
-                                get_image_download_link(processed_image, download_filename, "📥 Descargar imagen mejorada"),
-                                unsafe_allow_html=True
-                            )
-
-                        # Guardar en el historial
-                        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                        history_entry = {
-                            "timestamp": timestamp,
-                            "original_image": image,
-                            "processed_image": processed_image,
-                            "original_name": uploaded_file.name,
-                            "parameters": {
-                                "scale_factor": scale_factor,
-                                "face_enhance": face_enhance,
-                                "denoise_level": denoise_level,
-                                "output_format": output_format,
-                                "sharpness": sharpness,
-                                "contrast": contrast,
-                                "brightness": brightness,
-                                "color_balance": color_balance
-                            }
-                        }
-                        st.session_state.processed_images_history.append(history_entry)
+                    }
+                    add_history_entry(history_entry)
 
             except Exception as e:
                 st.error(f"Error al procesar la imagen: {str(e)}")
                 st.info("Por favor, asegúrate de usar una imagen en formato JPG o PNG válido.")
+        elif submitted:
+            st.warning("Selecciona al menos una imagen antes de procesar")
 
     with tab_history:
         st.header("Historial de Procesamiento")
@@ -289,11 +386,29 @@ def main():
 
                     with hist_col1:
                         st.subheader("Original")
-                        st.image(entry['original_image'], use_container_width=True)
+                        st.image(entry['original_thumb'])
 
                     with hist_col2:
                         st.subheader("Mejorada")
-                        st.image(entry['processed_image'], use_container_width=True)
+                        st.image(entry['processed_thumb'])
+
+                    # Las imágenes completas se leen de disco solo cuando se piden
+                    if st.button("Ver full res", key=f"full_res_{idx}_{entry['timestamp']}"):
+                        if not (os.path.exists(entry['original_path']) and os.path.exists(entry['processed_path'])):
+                            st.warning("Las imágenes completas de esta entrada ya no están disponibles")
+                        else:
+                            full_col1, full_col2 = st.columns(2)
+                            with full_col1:
+                                st.image(entry['original_path'], use_container_width=True)
+                            with full_col2:
+                                with open(entry['processed_path'], "rb") as file:
+                                    processed_data = file.read()
+                                st.image(processed_data, use_container_width=True)
+                                st.markdown(
+                                    get_image_download_link(processed_data, entry['download_filename'],
+                                                            "📥 Descargar", entry['processed_mime']),
+                                    unsafe_allow_html=True
+                                )
 
                     # Mostrar parámetros usados
                     st.markdown("**Parámetros utilizados:**")
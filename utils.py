@@ -1,14 +1,18 @@
 # Primero importamos las bibliotecas estándar
 import os
 import io
-import base64
-from urllib.request import urlopen
+import time
+import threading
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 # Luego las bibliotecas de terceros más estables
 import numpy as np
 from PIL import Image
 from PIL import ImageEnhance
+import requests
+from requests.adapters import HTTPAdapter
 import streamlit as st
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import replicate
 
 # Finalmente, intentamos importar OpenCV
@@ -18,9 +22,23 @@ except ImportError:
     st.error("Error: OpenCV no está disponible. Algunas funcionalidades pueden estar limitadas.")
     cv2 = None
 
+# pybase64 es un reemplazo directo con SIMD; si no está, se usa el módulo estándar
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
+
+# Tiempo máximo de espera de una predicción de Replicate, en segundos
+PREDICTION_TIMEOUT = 300
+
 def resize_if_needed(image, max_pixels=1000000):  # Reducido de 2000000 a 1000000
     """
     Redimensiona la imagen si excede el número máximo de píxeles.
+    Para JPEG se usa el modo draft de libjpeg, que decodifica directamente
+    a 1/2, 1/4 o 1/8 de la resolución antes del redimensionado final.
+    El draft modifica la imagen recibida (tamaño y escala de decodificación),
+    por lo que después de la llamada el llamador solo debe usarla en esa
+    resolución reducida o volver a abrirla.
     """
     width, height = image.size
     num_pixels = width * height
@@ -29,7 +47,20 @@ def resize_if_needed(image, max_pixels=1000000):  # Reducido de 2000000 a 100000
         ratio = (max_pixels / num_pixels) ** 0.5
         new_width = int(width * ratio)
         new_height = int(height * ratio)
-        return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
+
+        if image.format == "JPEG":
+            image.draft("RGB", (new_width * 2, new_height * 2))
+
+        if cv2 is not None and image.mode in ("RGB", "RGBA", "L"):
+            # INTER_AREA de OpenCV está vectorizado y es el filtro indicado para reducir
+            arr = np.asarray(image)
+            resized = cv2.resize(arr, (new_width, new_height), interpolation=cv2.INTER_AREA)
+            return Image.fromarray(resized)
+
+        # Tras el draft la reducción restante suele ser pequeña y BILINEAR basta
+        remaining_ratio = new_width / image.size[0]
+        resample = Image.Resampling.BILINEAR if remaining_ratio > 0.7 else Image.Resampling.LANCZOS
+        return image.resize((new_width, new_height), resample)
     return image
 
 @st.cache_resource
@@ -61,38 +92,231 @@ def load_model():
         st.error(f"Error al inicializar el cliente de Replicate: {str(e)}")
         return None
 
+@st.cache_resource
+def _http():
+    """
+    Sesión HTTP compartida para descargar los resultados, reutilizando
+    conexiones TLS entre descargas.
+    """
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=8)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=300, show_spinner=False)
+def api_reachable():
+    """
+    Indica si el cliente de Replicate se pudo inicializar; cacheado para no
+    repetir la verificación en cada rerun.
+    """
+    client = load_model()
+    return client is not None
+
+# Pesos de luminancia ITU-R 601, los mismos que usa PIL al convertir a 'L'
+_LUMA_WEIGHTS = np.array([0.299, 0.587, 0.114], dtype=np.float32)
+
 def apply_fine_tuning(image, params):
     """
     Aplica ajustes finos a la imagen usando los parámetros especificados.
+    Brillo, contraste y color son afines por canal, así que se aplican en una
+    sola pasada sobre un array de NumPy en lugar de un ImageEnhance por ajuste.
     """
+    # Con todos los factores en 1.0 no hay nada que hacer; evita la copia de convert('RGB')
+    if all(abs(params.get(k, 1.0) - 1.0) < 1e-6 for k in ("sharpness", "contrast", "brightness", "color_balance")):
+        return image
+
     try:
         if image.mode != 'RGB':
             image = image.convert('RGB')
 
-        if params.get('sharpness', 1.0) != 1.0:
+        sharpness = params.get('sharpness', 1.0)
+        contrast = params.get('contrast', 1.0)
+        brightness = params.get('brightness', 1.0)
+        color_balance = params.get('color_balance', 1.0)
+
+        if sharpness != 1.0 and cv2 is None:
             enhancer = ImageEnhance.Sharpness(image)
-            image = enhancer.enhance(params['sharpness'])
+            image = enhancer.enhance(sharpness)
 
-        if params.get('contrast', 1.0) != 1.0:
-            enhancer = ImageEnhance.Contrast(image)
-            image = enhancer.enhance(params['contrast'])
+        arr = np.asarray(image)
 
-        if params.get('brightness', 1.0) != 1.0:
-            enhancer = ImageEnhance.Brightness(image)
-            image = enhancer.enhance(params['brightness'])
+        if sharpness != 1.0 and cv2 is not None:
+            # Unsharp mask: mezcla original/desenfocada en una sola pasada de addWeighted
+            blurred = cv2.GaussianBlur(arr, (0, 0), sigmaX=1.0)
+            amount = sharpness - 1.0  # 0.0 = sin cambios, como en PIL
+            arr = cv2.addWeighted(arr, 1 + amount, blurred, -amount, 0)
 
-        if params.get('color_balance', 1.0) != 1.0:
-            enhancer = ImageEnhance.Color(image)
-            image = enhancer.enhance(params['color_balance'])
+        if contrast != 1.0 or brightness != 1.0 or color_balance != 1.0:
+            arr = arr.astype(np.float32)
 
-        return image
+            if contrast != 1.0 or brightness != 1.0:
+                # Contraste alrededor de la luminancia media, con el brillo plegado en el factor
+                mean = float((arr @ _LUMA_WEIGHTS).mean()) if contrast != 1.0 else 0.0
+                arr = arr * (contrast * brightness) + mean * (1.0 - contrast) * brightness
+
+            if color_balance != 1.0:
+                gray = (arr @ _LUMA_WEIGHTS)[..., np.newaxis]
+                arr = gray + (arr - gray) * color_balance
+
+            arr = np.clip(arr, 0, 255).astype(np.uint8)
+
+        return Image.fromarray(arr)
     except Exception as e:
         st.error(f"Error al aplicar ajustes finos: {str(e)}")
         return image
 
+@st.cache_data(show_spinner=False, max_entries=32, ttl=24 * 3600)
+def _upscale_via_replicate(image_bytes, scale, face_enhance, noise_level,
+                           _show_progress=True, _cancel_event=None):
+    """
+    Envía la imagen a Replicate y devuelve los bytes PNG de la imagen escalada.
+    Se cachea por (bytes de la imagen, parámetros) para no repetir la llamada
+    a la API cuando se vuelve a enviar la misma imagen. `_show_progress` y
+    `_cancel_event` no forman parte de la clave: el primero se desactiva al
+    llamarla desde hilos sin contexto de Streamlit y el segundo (un
+    threading.Event) permite cancelar la predicción desde otro hilo.
+    """
+    client = load_model()
+    if client is None:
+        raise RuntimeError("No se pudo inicializar el cliente de Replicate")
+
+    # Subir la imagen desde memoria, sin pasar por un archivo temporal
+    buf = io.BytesIO(image_bytes)
+    buf.name = "image.png"  # El SDK de Replicate usa .name para el MIME
+
+    prediction = client.predictions.create(
+        version="42fed1c4974146d4d2414e2be2c5277c7fcf05fcc3a73abf41610695738c1d7b",
+        input={
+            "image": buf,
+            "face_enhance": face_enhance,
+            "scale": scale,
+            "noise_level": noise_level
+        }
+    )
+
+    # Consultar el estado con backoff exponencial en lugar de bloquear en client.run
+    progress_bar = st.progress(0.0, "En cola en Replicate...") if _show_progress else None
+    delay = 0.5
+    deadline = time.monotonic() + PREDICTION_TIMEOUT
+    try:
+        while prediction.status not in ("succeeded", "failed", "canceled"):
+            if _cancel_event is None:
+                time.sleep(delay)
+            elif _cancel_event.wait(delay):
+                raise RuntimeError("El procesamiento fue interrumpido")
+            if time.monotonic() > deadline:
+                raise TimeoutError(f"Replicate no terminó la predicción en {PREDICTION_TIMEOUT} s")
+            delay = min(delay * 1.5, 4.0)
+            prediction.reload()
+            if progress_bar is not None:
+                if prediction.status == "processing":
+                    progress_bar.progress(0.5, "Procesando en Replicate...")
+                else:
+                    progress_bar.progress(0.1, f"Estado en Replicate: {prediction.status}")
+    except BaseException:
+        # Si se interrumpe (rerun, stop, cancelación o timeout), liberar la predicción en Replicate
+        if prediction.status not in ("succeeded", "failed", "canceled"):
+            try:
+                prediction.cancel()
+            except Exception:
+                # Un fallo al cancelar no debe ocultar la excepción original
+                pass
+        raise
+    finally:
+        if progress_bar is not None:
+            progress_bar.empty()
+
+    if prediction.status == "failed":
+        raise replicate.exceptions.ModelError(prediction)
+    if prediction.status == "canceled":
+        raise RuntimeError("La predicción fue cancelada en Replicate")
+
+    output = prediction.output
+
+    if hasattr(output, 'url'):
+        image_url = output.url
+    elif isinstance(output, list) and len(output) > 0:
+        image_url = output[0]
+    elif isinstance(output, str):
+        image_url = output
+    else:
+        raise ValueError(f"Formato de respuesta inesperado del modelo - {type(output)}")
+
+    response = _http().get(image_url, timeout=60)
+    response.raise_for_status()
+    return response.content
+
+def _model_params(advanced_params):
+    """Extrae de los parámetros avanzados los que se envían al modelo."""
+    face_enhance = advanced_params.get('face_enhance', True) if advanced_params else True
+    noise_level = advanced_params.get('denoise_level', 1) if advanced_params else 1
+    return face_enhance, noise_level
+
+def _prepare_upload(image):
+    """
+    Limita la imagen al tamaño máximo de entrada y la codifica como PNG
+    para subirla. Devuelve los bytes o None si falla.
+    """
+    # Limitar la imagen de entrada a 1 MP; el resultado escalado no tiene un límite propio
+    try:
+        original_size = image.size
+        image = resize_if_needed(image)
+    except Exception as resize_error:
+        st.error(f"Error al redimensionar la imagen: {str(resize_error)}")
+        return None
+
+    if image.size != original_size:
+        st.info(f"La imagen se redujo de {original_size[0]}x{original_size[1]} a "
+                f"{image.size[0]}x{image.size[1]} px para respetar el límite de entrada")
+
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=False, compress_level=1)
+    return buf.getvalue()
+
+def _finish_result(result_bytes, advanced_params):
+    """
+    Aplica los ajustes finos y el formato de salida a la imagen escalada.
+    Devuelve una tupla (imagen PIL, bytes codificados, tipo MIME) o None si falla.
+    """
+    try:
+        # Decodificar una sola vez desde los bytes ya descargados
+        decoded_image = Image.open(io.BytesIO(result_bytes))
+        decoded_image.load()
+        result_image = decoded_image
+
+        if advanced_params:
+            result_image = apply_fine_tuning(result_image, advanced_params)
+
+        output_format = 'PNG'
+        if advanced_params and advanced_params.get('output_format'):
+            output_format = advanced_params['output_format'].upper()
+
+        if output_format == 'JPEG':
+            if result_image.mode not in ('RGB', 'L'):
+                result_image = result_image.convert('RGB')
+            buffer = io.BytesIO()
+            result_image.save(buffer, format='JPEG',
+                              quality=advanced_params.get('jpeg_quality') or 95)
+            result_data, mime = buffer.getvalue(), "image/jpeg"
+        elif result_image is decoded_image and decoded_image.format == 'PNG':
+            # Sin modificaciones: el PNG descargado de Replicate sirve tal cual
+            result_data, mime = result_bytes, "image/png"
+        else:
+            # zlib nivel 1: ~4x más rápido que el nivel 6 por defecto, archivo algo mayor
+            buffer = io.BytesIO()
+            result_image.save(buffer, format='PNG', compress_level=1, optimize=False)
+            result_data, mime = buffer.getvalue(), "image/png"
+
+        return result_image, result_data, mime
+
+    except Exception as e:
+        st.error(f"Error al procesar la respuesta del modelo: {str(e)}")
+        return None
+
 def process_image(image, scale_factor, advanced_params=None):
     """
     Procesa la imagen usando el modelo de upscaling Clarity AI.
+    Devuelve una tupla (imagen PIL, bytes codificados, tipo MIME) o None si falla.
     """
     try:
         client = load_model()
@@ -100,99 +324,108 @@ def process_image(image, scale_factor, advanced_params=None):
             st.error("No se pudo inicializar el cliente de Replicate")
             return None
 
-        # Redimensionar la imagen si es necesario
-        try:
-            image = resize_if_needed(image)
-        except Exception as resize_error:
-            st.error(f"Error al redimensionar la imagen: {str(resize_error)}")
-            return None
-
-        # Verificar dimensiones finales
-        width, height = image.size
-        total_pixels = width * height * scale_factor * scale_factor
-        if total_pixels > 1000000:  # Límite después del escalado
-            st.error(f"""
-            La imagen es demasiado grande para ser procesada.
-            Dimensiones actuales: {width}x{height}
-            Por favor, utiliza una imagen más pequeña o redúcela manualmente antes de subirla.
-            """)
+        image_bytes = _prepare_upload(image)
+        if image_bytes is None:
             return None
 
         try:
-            params = {
-                "face_enhance": advanced_params.get('face_enhance', True) if advanced_params else True,
-                "scale": scale_factor,
-                "noise_level": advanced_params.get('denoise_level', 1) if advanced_params else 1
-            }
-
-            # Guardar la imagen temporalmente
-            temp_path = "temp_image.png"
-            image.save(temp_path)
+            face_enhance, noise_level = _model_params(advanced_params)
 
             st.info("Procesando imagen con Clarity AI...")
+            result_bytes = _upscale_via_replicate(image_bytes, scale_factor, face_enhance, noise_level)
 
-            with open(temp_path, "rb") as file:
-                output = client.run(
-                    "nightmareai/real-esrgan:42fed1c4974146d4d2414e2be2c5277c7fcf05fcc3a73abf41610695738c1d7b",
-                    input={
-                        "image": file,
-                        **params
-                    }
-                )
-
-            # Eliminar el archivo temporal
-            if os.path.exists(temp_path):
-                os.remove(temp_path)
-
-            try:
-                if hasattr(output, 'url'):
-                    image_url = output.url
-                elif isinstance(output, list) and len(output) > 0:
-                    image_url = output[0]
-                elif isinstance(output, str):
-                    image_url = output
-                else:
-                    st.error(f"Error: Formato de respuesta inesperado del modelo - {type(output)}")
-                    return None
-
-                st.info("Descargando imagen procesada...")
-                response = urlopen(image_url)
-                result_image = Image.open(response)
-
-                if advanced_params:
-                    result_image = apply_fine_tuning(result_image, advanced_params)
-
-                if advanced_params and advanced_params.get('output_format'):
-                    output_format = advanced_params['output_format'].upper()
-                    if output_format == 'JPEG':
-                        if result_image.mode in ('RGBA', 'LA'):
-                            result_image = result_image.convert('RGB')
-                        buffer = io.BytesIO()
-                        result_image.save(buffer, format='JPEG', 
-                                          quality=advanced_params.get('jpeg_quality', 95))
-                        buffer.seek(0)
-                        result_image = Image.open(buffer)
-
-                st.success("✅ Imagen procesada exitosamente")
-                return result_image
-
-            except Exception as e:
-                st.error(f"Error al procesar la respuesta del modelo: {str(e)}")
-                return None
-
-        except replicate.exceptions.ReplicateError as api_error:
+        except (replicate.exceptions.ReplicateError, replicate.exceptions.ModelError) as api_error:
             st.error(f"Error al procesar la imagen: {str(api_error)}")
             return None
 
+        result = _finish_result(result_bytes, advanced_params)
+        if result is not None:
+            st.success("✅ Imagen procesada exitosamente")
+        return result
+
     except Exception as e:
         st.error(f"Error general: {str(e)}")
         return None
 
-def get_image_download_link(img, filename, text):
-    """Genera un link de descarga para la imagen procesada."""
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    img_str = buffered.getvalue()
-    b64 = base64.b64encode(img_str).decode()
-    href = f'<a href="data:file/png;base64,{b64}" download="{filename}">{text}</a>'
+def process_images(images, scale_factor, advanced_params=None, max_workers=4):
+    """
+    Procesa varias imágenes lanzando las predicciones de Replicate en paralelo.
+    Devuelve una lista alineada con `images` con el resultado de cada una
+    (tupla como en process_image) o None si falló.
+    """
+    if len(images) == 1:
+        return [process_image(images[0], scale_factor, advanced_params)]
+
+    results = [None] * len(images)
+    try:
+        client = load_model()
+        if client is None:
+            st.error("No se pudo inicializar el cliente de Replicate")
+            return results
+
+        face_enhance, noise_level = _model_params(advanced_params)
+        uploads = [_prepare_upload(image) for image in images]
+
+        # Agrupar subidas idénticas para lanzar una sola predicción por contenido
+        pending = {}
+        for idx, image_bytes in enumerate(uploads):
+            if image_bytes is not None:
+                pending.setdefault(image_bytes, []).append(idx)
+        if not pending:
+            return results
+
+        total = len(pending)
+        st.info(f"Procesando {total} imágenes con Clarity AI...")
+        progress_bar = st.progress(0.0, f"0/{total} imágenes procesadas")
+
+        # Las predicciones pasan casi todo el tiempo esperando a Replicate, así que se solapan en hilos
+        cancel_event = threading.Event()
+        # Los hilos heredan el contexto de la sesión para que las funciones cacheadas no avisen de su ausencia
+        executor = ThreadPoolExecutor(max_workers=max_workers, initializer=add_script_run_ctx,
+                                      initargs=(None, get_script_run_ctx()))
+        try:
+            futures = {
+                executor.submit(_upscale_via_replicate, image_bytes, scale_factor, face_enhance,
+                                noise_level, _show_progress=False, _cancel_event=cancel_event): indices
+                for image_bytes, indices in pending.items()
+            }
+            not_done = set(futures)
+            done_count = 0
+            while not_done:
+                # El timeout permite refrescar la barra, que es donde Streamlit detecta un stop o rerun
+                done, not_done = wait(not_done, timeout=1.0, return_when=FIRST_COMPLETED)
+                for future in done:
+                    indices = futures[future]
+                    label = ", ".join(str(idx + 1) for idx in indices)
+                    try:
+                        result = _finish_result(future.result(), advanced_params)
+                        for idx in indices:
+                            results[idx] = result
+                    except (replicate.exceptions.ReplicateError, replicate.exceptions.ModelError) as api_error:
+                        st.error(f"Error al procesar la imagen {label}: {str(api_error)}")
+                    except Exception as e:
+                        st.error(f"Error general en la imagen {label}: {str(e)}")
+                done_count += len(done)
+                progress_bar.progress(done_count / total, f"{done_count}/{total} imágenes procesadas")
+        except BaseException:
+            # Interrumpido (stop, rerun o error): cancelar las predicciones en curso sin esperar a los hilos
+            cancel_event.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
+        executor.shutdown()
+
+        progress_bar.empty()
+        processed = sum(result is not None for result in results)
+        if processed:
+            st.success(f"✅ {processed} de {len(images)} imágenes procesadas exitosamente")
+        return results
+
+    except Exception as e:
+        st.error(f"Error general: {str(e)}")
+        return results
+
+def get_image_download_link(data, filename, text, mime="image/png"):
+    """Genera un link de descarga a partir de los bytes ya codificados de la imagen."""
+    b64 = base64.b64encode(data).decode('ascii')
+    href = f'<a href="data:{mime};base64,{b64}" download="{filename}">{text}</a>'
     return href